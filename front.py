@@ -1,53 +1,159 @@
-from flask import Flask, send_file, jsonify, render_template_string, request, Response
+from flask import Flask, send_file, request, Response
 from datetime import datetime
 import os
 import mimetypes
 from pathlib import Path
 import re
+import heapq
+import time
+import gzip
+import hashlib
+import orjson
+import threading
+from collections import OrderedDict
+from stat import S_ISREG
+from werkzeug.http import http_date
+from werkzeug.wsgi import wrap_file
+from werkzeug.security import safe_join
 
 app = Flask(__name__)
 
 # Configure maximum content length for large audio files
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
 
+# Create uploads directory if it doesn't exist
+Path('uploads').mkdir(exist_ok=True)
+
+_RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)')
+
 def parse_range_header(range_header, file_size):
     """Parse Range header and return start and end bytes"""
-    if not range_header:
+    if not range_header or not range_header.startswith('bytes='):
         return 0, file_size - 1
     
-    match = re.match(r'bytes=(\d+)-(\d*)', range_header)
-    if not match:
-        return 0, file_size - 1
+    # Fast path for the plain "bytes=N-" / "bytes=N-M" form players send
+    start, sep, end = range_header[6:].partition('-')
+    if not (sep and start.isdecimal() and (not end or end.isdecimal())):
+        match = _RANGE_RE.match(range_header)
+        if not match:
+            return 0, file_size - 1
+        start, end = match.groups()
     
-    start = int(match.group(1))
-    end = int(match.group(2)) if match.group(2) else file_size - 1
+    start = int(start)
+    end = int(end) if end else file_size - 1
     
     return min(start, file_size - 1), min(end, file_size - 1)
 
+class FileRange:
+    """Read-only file object limited to one byte range, for wsgi.file_wrapper"""
+    def __init__(self, file_path, start, length):
+        self.file_path = file_path
+        self.start = start
+        self.remaining = length
+        self.file = None
+
+    def _open(self):
+        # Opened on first use so nothing leaks if the response is never sent
+        if self.file is None:
+            self.file = open(self.file_path, 'rb')
+            self.file.seek(self.start)
+        return self.file
+
+    def fileno(self):
+        return self._open().fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = max(self.remaining, 0)
+        data = self._open().read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+# upload path -> (time.monotonic() of the stat, size, mtime_ns), in
+# least-recently-used order
+_stat_cache = OrderedDict()
+_stat_cache_lock = threading.Lock()
+STAT_CACHE_SIZE = 256
+
+def stat_upload(path):
+    """Return (size, mtime_ns) of an uploaded file, cached for one second"""
+    now = time.monotonic()
+    with _stat_cache_lock:
+        cached = _stat_cache.get(path)
+        if cached and now - cached[0] < 1.0:
+            _stat_cache.move_to_end(path)
+            return cached[1:]
+    
+    st = os.stat(path)
+    if not S_ISREG(st.st_mode):
+        raise FileNotFoundError(path)
+    
+    with _stat_cache_lock:
+        _stat_cache[path] = (now, st.st_size, st.st_mtime_ns)
+        _stat_cache.move_to_end(path)
+        if len(_stat_cache) > STAT_CACHE_SIZE:
+            _stat_cache.popitem(last=False)
+    return st.st_size, st.st_mtime_ns
+
 @app.route('/uploads/<path:filename>')
 def serve_audio(filename):
     """Serve audio files with byte-range support for better streaming"""
-    uploads_dir = Path('uploads')
-    file_path = uploads_dir / filename
+    # safe_join normalizes the path and rejects anything outside uploads/
+    file_path = safe_join('uploads', filename)
+    if file_path is None:
+        return "File not found", 404
     
-    if not file_path.exists() or not file_path.is_file():
+    # Players send many Range requests per file; one cached stat covers
+    # the existence check, the size and the validators
+    try:
+        file_size, mtime_ns = stat_upload(file_path)
+    except OSError:
         return "File not found", 404
     
-    file_size = file_path.stat().st_size
+    etag = f'{file_size:x}-{mtime_ns:x}'
+    last_modified = mtime_ns / 1e9
+    
+    # Uploads can be overwritten or still growing, so clients revalidate
+    # every time; a matching ETag costs no body at all
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.headers['ETag'] = f'"{etag}"'
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
     range_header = request.headers.get('Range')
     
+    # Whole-file requests go through send_file so the WSGI server can use
+    # its file wrapper (sendfile) instead of copying through Python.
+    # send_file resolves relative paths against the app root, so pass the
+    # absolute path to stay on the same uploads dir as the rest of the view
+    if range_header is None:
+        response = send_file(
+            os.path.abspath(file_path),
+            mimetype='audio/wav',
+            conditional=True,
+            etag=etag,
+            last_modified=last_modified,
+            max_age=0
+        )
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
     # Parse range header if present
     start, end = parse_range_header(range_header, file_size)
+    if file_size == 0 or start > end:
+        response = Response(status=416)
+        response.headers['Content-Range'] = f'bytes */{file_size}'
+        return response
     chunk_size = end - start + 1
     
-    # Open file in binary mode
-    with open(file_path, 'rb') as f:
-        f.seek(start)
-        data = f.read(chunk_size)
-    
     response = Response(
-        data,
-        206 if range_header else 200,
+        wrap_file(request.environ, FileRange(file_path, start, chunk_size), 65536),
+        206,
         mimetype='audio/wav',
         direct_passthrough=True
     )
@@ -55,37 +161,64 @@ def serve_audio(filename):
     response.headers['Accept-Ranges'] = 'bytes'
     response.headers['Content-Range'] = f'bytes {start}-{end}/{file_size}'
     response.headers['Content-Length'] = chunk_size
+    response.headers['ETag'] = f'"{etag}"'
+    response.headers['Last-Modified'] = http_date(last_modified)
     response.headers['Cache-Control'] = 'no-cache'
     
     return response
 
+def encode_latest_recordings(uploads_dir):
+    """Return (json, gzipped json, etag) for the newest recordings"""
+    with os.scandir(uploads_dir) as it:
+        entries = [(entry.name, entry.stat()) for entry in it
+                   if entry.name.endswith('.wav')]
+    
+    # Newest first by creation time, limited to 50
+    latest = heapq.nlargest(50, entries, key=lambda entry: entry[1].st_ctime)
+    body = orjson.dumps([{
+        'name': name,
+        'size': stat.st_size,
+        'created': datetime.fromtimestamp(stat.st_ctime).isoformat()
+    } for name, stat in latest])
+    
+    return body, gzip.compress(body), hashlib.sha1(body).hexdigest()
+
+# (uploads dir mtime_ns, time.monotonic() of the scan, encoded listing)
+_latest_cache = (None, 0.0, None)
+
 @app.route('/latest')
 def get_latest_recordings():
     """Get the 10 most recent recordings"""
+    global _latest_cache
     uploads_dir = Path('uploads')
     
-    if not uploads_dir.exists():
-        uploads_dir.mkdir(exist_ok=True)
-        return jsonify([])
+    # Reuse the last listing while the directory is unchanged; the short
+    # TTL also picks up files that are still growing
+    dir_mtime = os.stat(uploads_dir).st_mtime_ns
+    cached_mtime, cached_at, encoded = _latest_cache
+    if cached_mtime != dir_mtime or time.monotonic() - cached_at >= 1.0:
+        encoded = encode_latest_recordings(uploads_dir)
+        _latest_cache = (dir_mtime, time.monotonic(), encoded)
     
-    recordings = []
+    body, gzipped_body, etag = encoded
     
-    for file_path in uploads_dir.glob('*.wav'):
-        stat = file_path.stat()
-        recordings.append({
-            'name': file_path.name,
-            'size': stat.st_size,
-            'created': datetime.fromtimestamp(stat.st_ctime).isoformat()
-        })
+    # The page polls every 30 seconds; unchanged listings cost a 304
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    elif request.accept_encodings['gzip']:
+        response = Response(gzipped_body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(body, mimetype='application/json')
     
-    # Sort by creation time (newest first) and limit to 10
-    recordings.sort(key=lambda x: x['created'], reverse=True)
-    return jsonify(recordings[:50])
+    # Weak, since the gzip and identity bodies share it
+    response.headers['ETag'] = f'W/"{etag}"'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
-@app.route('/')
-def index():
-    """Serve the frontend page"""
-    html = """
+# The page is static, so it is encoded once instead of rendered per request
+INDEX_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -211,12 +344,15 @@ def index():
         </script>
     </body>
     </html>
-    """
-    return render_template_string(html)
+    """.encode('utf-8')
+
+@app.route('/')
+def index():
+    """Serve the frontend page"""
+    response = Response(INDEX_HTML, mimetype='text/html')
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
 
 if __name__ == '__main__':
-    # Create uploads directory if it doesn't exist
-    Path('uploads').mkdir(exist_ok=True)
-    
     # Run the server
     app.run(host='0.0.0.0', port=8002, threaded=True)
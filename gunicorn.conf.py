@@ -0,0 +1,14 @@
+# Gunicorn settings for the Flask servers, e.g.
+#   gunicorn -c gunicorn.conf.py server2:app
+#   gunicorn -c gunicorn.conf.py -b 0.0.0.0:8002 front:app
+bind = '0.0.0.0:8001'
+
+# Threads overlap I/O and the parts that release the GIL: server2.py's
+# nogil ADPCM kernel and Whisper's torch ops. server.py's decoder is pure
+# Python and holds the GIL, so its decodes still run one at a time
+worker_class = 'gthread'
+threads = 8
+
+# A single process: server2.py keeps transcription jobs in memory and
+# /transcription/<jobId> has to reach the process that queued the job
+workers = 1
@@ -2,6 +2,8 @@ from flask import Flask, request, send_file, jsonify
 from werkzeug.utils import secure_filename
 import numpy as np
 import os
+import array
+import wave
 from io import BytesIO
 
 app = Flask(__name__)
@@ -33,83 +35,68 @@ index_table = np.array([
     -1, -1, -1, -1, 2, 4, 6, 8
 ], dtype=np.int8)
 
-class ADPCMDecoder:
-    def __init__(self):
-        self.predictor = 0
-        self.step_index = 0
-
-    def decode_sample(self, code):
-        step = int(step_table[self.step_index])  # Convert to int for higher precision
-        predictor = self.predictor
-
-        # Compute difference
-        difference = step >> 3
-        if code & 4:
-            difference += step
-        if code & 2:
-            difference += step >> 1
-        if code & 1:
-            difference += step >> 2
-
-        # Add or subtract from predictor
-        if code & 8:
-            predictor -= difference
-        else:
-            predictor += difference
-
-        # Clamp predictor to 16-bit range
-        predictor = max(-32768, min(32767, predictor))
-        self.predictor = predictor
-
-        # Update step index
-        self.step_index += index_table[code]
-        self.step_index = max(0, min(88, self.step_index))
-
-        return predictor
-
-    def decode(self, adpcm_data):
-        pcm_data = np.zeros(len(adpcm_data) * 2, dtype=np.int16)  # Final output as int16
-        pcm_offset = 0
-
-        for byte in adpcm_data:
-            # Decode high nibble
-            pcm_data[pcm_offset] = self.decode_sample((byte >> 4) & 0x0F)
-            pcm_offset += 1
-            # Decode low nibble
-            pcm_data[pcm_offset] = self.decode_sample(byte & 0x0F)
+def decode_adpcm(adpcm_data):
+    # Tables as plain lists and decoder state in locals, so the hot loop
+    # does no attribute lookups, method calls or numpy scalar math
+    steps = step_table.tolist()
+    index_steps = index_table.tolist()
+    predictor = 0
+    step_index = 0
+
+    # Two int16 samples per byte, preallocated as C shorts
+    pcm_data = array.array('h', bytes(4 * len(adpcm_data)))
+    pcm_offset = 0
+
+    for byte in adpcm_data:
+        # High nibble first, then low nibble
+        for code in (byte >> 4, byte & 0x0F):
+            step = steps[step_index]
+
+            # Compute difference
+            difference = step >> 3
+            if code & 4:
+                difference += step
+            if code & 2:
+                difference += step >> 1
+            if code & 1:
+                difference += step >> 2
+
+            # Add or subtract from predictor, clamped to 16-bit range
+            if code & 8:
+                predictor -= difference
+                if predictor < -32768:
+                    predictor = -32768
+            else:
+                predictor += difference
+                if predictor > 32767:
+                    predictor = 32767
+
+            pcm_data[pcm_offset] = predictor
             pcm_offset += 1
 
-        return pcm_data
+            # Update step index
+            step_index += index_steps[code]
+            if step_index < 0:
+                step_index = 0
+            elif step_index > 88:
+                step_index = 88
 
+    return pcm_data
 
-def convert_adpcm_to_pcm(input_file_path):
-    with open(input_file_path, 'rb') as f:
-        # Read WAV header
-        header = bytearray(f.read(44))
-        
-        # Read ADPCM data
-        adpcm_data = np.frombuffer(f.read(), dtype=np.uint8)
-    
-    # Create decoder and convert data
-    decoder = ADPCMDecoder()
-    pcm_data = decoder.decode(adpcm_data)
+
+def convert_adpcm_to_pcm(adpcm_wav, output_file_path):
+    # Skip the 44-byte WAV header; the rest is ADPCM data. Iterating a
+    # memoryview yields plain ints rather than numpy scalars
+    adpcm_data = memoryview(adpcm_wav)[44:]
     
-    # Create new WAV header for PCM format
-    output_header = bytearray(44)
-    output_header[0:4] = b'RIFF'
-    output_header[8:12] = b'WAVE'
-    output_header[12:16] = b'fmt '
-    output_header[16:20] = (16).to_bytes(4, 'little')  # Subchunk1Size
-    output_header[20:22] = (1).to_bytes(2, 'little')   # AudioFormat (PCM)
-    output_header[22:24] = (1).to_bytes(2, 'little')   # NumChannels
-    output_header[24:28] = (16000).to_bytes(4, 'little')  # SampleRate
-    output_header[28:32] = (32000).to_bytes(4, 'little')  # ByteRate
-    output_header[32:34] = (2).to_bytes(2, 'little')    # BlockAlign
-    output_header[34:36] = (16).to_bytes(2, 'little')   # BitsPerSample
-    output_header[36:40] = b'data'
-    output_header[40:44] = len(pcm_data.tobytes()).to_bytes(4, 'little')  # Subchunk2Size
+    pcm_data = decode_adpcm(adpcm_data)
     
-    return output_header + pcm_data.tobytes()
+    # Write PCM WAV: 16kHz, mono, 16-bit
+    with wave.open(output_file_path, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(16000)
+        wav_file.writeframes(pcm_data)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -123,18 +110,16 @@ def upload_file():
     if file:
         filename = secure_filename(file.filename)
         input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(input_path)
+        # Read the upload once: save it as-is and decode the same buffer
+        adpcm_wav = file.stream.read()
+        with open(input_path, 'wb') as f:
+            f.write(adpcm_wav)
 
         try:
-            # Convert ADPCM to PCM
-            pcm_data = convert_adpcm_to_pcm(input_path)
-            
-            # Save converted file
+            # Convert ADPCM to PCM and save converted file
             output_filename = filename.replace('.wav', '_pcm.wav')
             output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-            
-            with open(output_path, 'wb') as f:
-                f.write(pcm_data)
+            convert_adpcm_to_pcm(adpcm_wav, output_path)
 
             return jsonify({
                 'message': 'File uploaded and converted successfully',
@@ -149,11 +134,12 @@ def upload_file():
 def get_audio(filename):
     try:
         return send_file(
-            os.path.join(app.config['UPLOAD_FOLDER'], filename),
-            mimetype='audio/wav'
+            os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], filename)),
+            mimetype='audio/wav',
+            conditional=True
         )
     except Exception:
         return jsonify({'error': 'File not found'}), 404
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8001, debug=True)
+    app.run(host='0.0.0.0', port=8001)
@@ -1,7 +1,12 @@
 from flask import Flask, request, send_file, jsonify
 from werkzeug.utils import secure_filename
 import numpy as np
+from numba import njit
 import os
+import struct
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from io import BytesIO
 import whisper
@@ -35,85 +40,126 @@ index_table = np.array([
     -1, -1, -1, -1, 2, 4, 6, 8
 ], dtype=np.int8)
 
-class ADPCMDecoder:
-    def __init__(self):
-        self.predictor = 0
-        self.step_index = 0
-
-    def decode_sample(self, code):
-        step = int(step_table[self.step_index])  # Convert to int for higher precision
-        predictor = self.predictor
-
-        # Compute difference
-        difference = step >> 3
-        if code & 4:
-            difference += step
-        if code & 2:
-            difference += step >> 1
-        if code & 1:
-            difference += step >> 2
-
-        # Add or subtract from predictor
-        if code & 8:
-            predictor -= difference
-        else:
-            predictor += difference
+# PCM WAV header: 16kHz, mono, 16-bit. The RIFF chunk size (offset 4) and
+# data chunk size (offset 40) are filled in per file.
+WAV_HEADER_TEMPLATE = struct.pack(
+    '<4sI4s4sIHHIIHH4sI',
+    b'RIFF', 0, b'WAVE',
+    b'fmt ', 16, 1, 1, 16000, 32000, 2, 16,
+    b'data', 0
+)
+
+def _build_decode_tables():
+    """Fuse the step and index tables into per-(step_index, code) lookups"""
+    steps = step_table.astype(np.int32)[:, np.newaxis]
+    codes = np.arange(16, dtype=np.int32)[np.newaxis, :]
+
+    # Same difference the IMA decoder assembles from the code bits
+    difference = ((steps >> 3)
+                  + np.where(codes & 4, steps, 0)
+                  + np.where(codes & 2, steps >> 1, 0)
+                  + np.where(codes & 1, steps >> 2, 0))
+    delta = np.where(codes & 8, -difference, difference)
+
+    next_index = np.clip(
+        np.arange(step_table.size, dtype=np.int32)[:, np.newaxis] + index_table,
+        0, step_table.size - 1
+    )
+
+    return delta.astype(np.int32), next_index.astype(np.int32)
+
+# 89 x 16 tables: signed predictor delta and next step index
+delta_table, next_index_table = _build_decode_tables()
+
+@njit(cache=True, nogil=True)
+def _decode_adpcm(nibbles, delta_table, next_index_table, out):
+    predictor = np.int32(0)
+    step_index = np.int32(0)
+
+    for i in range(nibbles.size):
+        code = nibbles[i]
 
         # Clamp predictor to 16-bit range
-        predictor = max(-32768, min(32767, predictor))
-        self.predictor = predictor
+        predictor = min(32767, max(-32768, predictor + delta_table[step_index, code]))
+        out[i] = predictor
 
-        # Update step index
-        self.step_index += index_table[code]
-        self.step_index = max(0, min(88, self.step_index))
+        step_index = next_index_table[step_index, code]
 
-        return predictor
+    return out
 
-    def decode(self, adpcm_data):
-        pcm_data = np.zeros(len(adpcm_data) * 2, dtype=np.int16)  # Final output as int16
-        pcm_offset = 0
 
-        for byte in adpcm_data:
-            # Decode high nibble
-            pcm_data[pcm_offset] = self.decode_sample((byte >> 4) & 0x0F)
-            pcm_offset += 1
-            # Decode low nibble
-            pcm_data[pcm_offset] = self.decode_sample(byte & 0x0F)
-            pcm_offset += 1
+def write_file(path, *chunks):
+    """Write buffers to a file with unbuffered os.write calls"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        for chunk in chunks:
+            view = memoryview(chunk).cast('B')
+            while view:
+                view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
 
-        return pcm_data
 
+def convert_adpcm_to_pcm(adpcm_wav, output_file_path):
+    # Skip the 44-byte WAV header; the rest is ADPCM data
+    adpcm_data = np.frombuffer(memoryview(adpcm_wav)[44:], dtype=np.uint8)
+    
+    # Split each byte into its high and low nibble, in playback order
+    nibbles = np.empty(adpcm_data.size * 2, dtype=np.uint8)
+    nibbles[0::2] = adpcm_data >> 4
+    nibbles[1::2] = adpcm_data & 0x0F
 
-def convert_adpcm_to_pcm(input_file_path):
-    with open(input_file_path, 'rb') as f:
-        # Read WAV header
-        header = bytearray(f.read(44))
-        
-        # Read ADPCM data
-        adpcm_data = np.frombuffer(f.read(), dtype=np.uint8)
+    pcm_data = _decode_adpcm(nibbles, delta_table, next_index_table,
+                             np.empty(nibbles.size, dtype=np.int16))
     
-    # Create decoder and convert data
-    decoder = ADPCMDecoder()
-    pcm_data = decoder.decode(adpcm_data)
+    # Patch the sizes into the PCM header template
+    output_header = bytearray(WAV_HEADER_TEMPLATE)
+    struct.pack_into('<I', output_header, 4, 36 + pcm_data.nbytes)
+    struct.pack_into('<I', output_header, 40, pcm_data.nbytes)
     
-    # Create new WAV header for PCM format
-    output_header = bytearray(44)
-    output_header[0:4] = b'RIFF'
-    output_header[8:12] = b'WAVE'
-    output_header[12:16] = b'fmt '
-    output_header[16:20] = (16).to_bytes(4, 'little')  # Subchunk1Size
-    output_header[20:22] = (1).to_bytes(2, 'little')   # AudioFormat (PCM)
-    output_header[22:24] = (1).to_bytes(2, 'little')   # NumChannels
-    output_header[24:28] = (16000).to_bytes(4, 'little')  # SampleRate
-    output_header[28:32] = (32000).to_bytes(4, 'little')  # ByteRate
-    output_header[32:34] = (2).to_bytes(2, 'little')    # BlockAlign
-    output_header[34:36] = (16).to_bytes(2, 'little')   # BitsPerSample
-    output_header[36:40] = b'data'
-    output_header[40:44] = len(pcm_data.tobytes()).to_bytes(4, 'little')  # Subchunk2Size
+    # Write header and samples separately so the PCM buffer is not copied
+    write_file(output_file_path, output_header, pcm_data)
     
-    return output_header + pcm_data.tobytes()
+    return pcm_data
 model = whisper.load_model("base")
 
+# Whisper installs per-call hooks on the shared model, so transcriptions
+# run one at a time off the request thread
+transcription_pool = ThreadPoolExecutor(max_workers=1)
+transcription_jobs = {}
+MAX_TRANSCRIPTION_JOBS = 256
+
+# Each queued job holds its float32 audio until Whisper gets to it, so
+# uploads past this many pending jobs are refused instead of queued
+MAX_PENDING_TRANSCRIPTIONS = 16
+pending_transcriptions = threading.BoundedSemaphore(MAX_PENDING_TRANSCRIPTIONS)
+
+def add_transcription_job(job_id, job):
+    transcription_jobs[job_id] = job
+
+    # Uploaders that never poll would leak every result, so once the table
+    # is full drop the oldest finished jobs (dicts keep insertion order)
+    for old_id in list(transcription_jobs):
+        if len(transcription_jobs) <= MAX_TRANSCRIPTION_JOBS:
+            break
+        old_job = transcription_jobs.get(old_id)
+        if old_job is not None and old_job.done():
+            transcription_jobs.pop(old_id, None)
+
+def transcribe(audio):
+    result = model.transcribe(
+        audio,
+        task="translate",
+        fp16=model.device.type == "cuda",
+        condition_on_previous_text=False
+    )
+    transcription = result.get("text", "")
+    if transcription == "":
+        transcription = "failed to transcribe"
+
+    print(f"Transcription: {transcription}")  # Print transcription to console
+    return transcription
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'audio' not in request.files:
@@ -124,37 +170,41 @@ def upload_file():
         return jsonify({'error': 'No selected file'}), 400
 
     if file:
+        if not pending_transcriptions.acquire(blocking=False):
+            return jsonify({'error': 'Transcription queue is full, try again later'}), 503
+
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = secure_filename(f"{timestamp}_{file.filename}")
         input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(input_path)
+        job = None
 
         try:
-            # Convert ADPCM to PCM
-            pcm_data = convert_adpcm_to_pcm(input_path)
-            
-            # Save converted file
+            # Keep the upload in memory: it is saved as-is and decoded from
+            # the same buffer instead of being read back from disk
+            adpcm_wav = file.stream.read()
+            write_file(input_path, adpcm_wav)
+
+            # Convert ADPCM to PCM and save converted file
             output_filename = filename.replace('.wav', '_pcm.wav')
             output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-            
-            with open(output_path, 'wb') as f:
-                f.write(pcm_data)
+            pcm_data = convert_adpcm_to_pcm(adpcm_wav, output_path)
 
-            # Transcribe with Whisper
-            
-            result = model.transcribe(output_path, task="translate")
-            transcription = result.get("text", "")
-            if transcription == "":
-                transcription = "failed to transcribe"
+            # Whisper takes 16kHz float32 samples in [-1, 1), the same as it
+            # would get from decoding the saved file through ffmpeg
+            audio = pcm_data.astype(np.float32)
+            audio /= 32768.0
 
-            print(f"Transcription: {transcription}")  # Print transcription to console
-            # return transcription
+            # Queue transcription; poll /transcription/<jobId> for the result
+            job_id = uuid.uuid4().hex
+            job = transcription_pool.submit(transcribe, audio)
+            job.add_done_callback(lambda _: pending_transcriptions.release())
+            add_transcription_job(job_id, job)
 
             response_data = {
-                'message': 'File uploaded, converted, and transcribed successfully',
+                'message': 'File uploaded and converted successfully, transcription queued',
                 'originalFile': filename,
                 'pcmFile': output_filename,
-                'transcription': transcription
+                'jobId': job_id
             }
 
             # Create JSON response
@@ -168,20 +218,42 @@ def upload_file():
             return response
 
         except Exception as e:
+            # The slot is only handed back by the job once it is queued
+            if job is None:
+                pending_transcriptions.release()
             return jsonify({'error': str(e)}), 500
         
 
 
 
+@app.route('/transcription/<job_id>')
+def get_transcription(job_id):
+    job = transcription_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    if not job.done():
+        return jsonify({'status': 'pending'})
+
+    # Finished jobs are handed out once
+    transcription_jobs.pop(job_id, None)
+    try:
+        transcription = job.result()
+    except Exception as e:
+        return jsonify({'status': 'failed', 'error': str(e)}), 500
+
+    return jsonify({'status': 'done', 'transcription': transcription})
+
 @app.route('/audio/<filename>')
 def get_audio(filename):
     try:
         return send_file(
-            os.path.join(app.config['UPLOAD_FOLDER'], filename),
-            mimetype='audio/wav'
+            os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], filename)),
+            mimetype='audio/wav',
+            conditional=True
         )
     except Exception:
         return jsonify({'error': 'File not found'}), 404
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8001, debug=True)
+    app.run(host='0.0.0.0', port=8001)